@@ -6,6 +6,13 @@ import psycopg2
 from psycopg2.extras import RealDictCursor
 
 from src.ui_core.settings import load_settings  # if you keep settings.py at root
+from src.ui_core.prompt_versions import (
+    diff_versions,
+    ensure_versions_table,
+    list_versions,
+)
+from src.ui_core.prompts_repo import rollback_prompt, update_prompt
+from src.ui_core import profiling
 
 
 import streamlit as st
@@ -43,10 +50,21 @@ def _get_conn():
 
 
 def render_update_prompts():
+    with profiling.profile_rerun("update_prompts"):
+        _render_update_prompts()
+    profiling.render_profile_panel()
+
+
+def _render_update_prompts():
     st.header("Update prompts")
 
     enable_writes = True  # keep as-is
 
+    if not st.session_state.get("prompt_versions_ready"):
+        with _get_conn() as conn:
+            ensure_versions_table(conn)
+        st.session_state.prompt_versions_ready = True
+
     with _get_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
@@ -76,15 +94,53 @@ def render_update_prompts():
 
     prompt_text = st.text_area("Prompt", value=obj.get("prompt") or "", height=340)
 
+    note = st.text_input("Change note (optional)")
+
     if st.button("Save", type="primary", disabled=not enable_writes):
         with _get_conn() as conn:
-            with conn.cursor() as cur:
-                # Update only prompt
-                cur.execute(
-                    "UPDATE ai_prompts SET prompt = %s WHERE name = %s",
-                    (prompt_text, name),
-                )
-                conn.commit()
-
-        st.success("Updated.")
-        st.rerun()
+            # Update only prompt; previous text is kept in ai_prompt_versions
+            version = update_prompt(conn, name, prompt_text, note=note or None)
+
+        if not version:
+            st.error(f"Prompt '{name}' no longer exists; nothing was saved.")
+        else:
+            st.success(f"Updated (v{version}).")
+            st.rerun()
+
+    with st.expander("History"):
+        with _get_conn() as conn:
+            versions = list_versions(conn, name)
+
+        if not versions:
+            st.caption("No saved versions yet. The next Save starts the history.")
+            return
+
+        st.dataframe(versions, use_container_width=True, hide_index=True)
+
+        numbers = [v["version"] for v in versions]
+        c_from, c_to = st.columns(2)
+        with c_from:
+            v_from = st.selectbox(
+                "From", numbers, index=min(1, len(numbers) - 1), key="diff_from"
+            )
+        with c_to:
+            v_to = st.selectbox("To", numbers, index=0, key="diff_to")
+
+        with _get_conn() as conn:
+            diff = diff_versions(conn, name, v_from, v_to)
+        if diff:
+            st.code(diff, language="diff")
+        else:
+            st.caption("No differences.")
+
+        if st.button(
+            f"Roll back to v{v_from}",
+            disabled=not enable_writes or v_from == numbers[0],
+        ):
+            with _get_conn() as conn:
+                version = rollback_prompt(conn, name, v_from)
+            if not version:
+                st.error(f"Could not roll back: v{v_from} could not be restored.")
+            else:
+                st.success(f"Rolled back to v{v_from} (saved as v{version}).")
+                st.rerun()
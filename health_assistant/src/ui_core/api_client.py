@@ -1,13 +1,34 @@
 import json
-from typing import Any, Dict, List, Optional
+import time
+import uuid
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 import requests
 from dataclasses import dataclass
 
+from .scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    CallScheduler,
+    get_scheduler,
+)
+from .traffic import TraceRecorder, get_recorder
+
+if TYPE_CHECKING:
+    from .history_cache import HistoryCache
+
 
 @dataclass
 class Settings:
     base_url: str
     api_key: str = ""
+    # Live transcript updates: "api" (long-poll the backend), "local"
+    # (in-process stand-in, see live_updates.local_bus) or "off". Off by
+    # default: without /updates on the backend, "api" polls the full history.
+    live_updates: str = "off"
+    # Shared history cache across replicas: "postgres" or "off".
+    history_cache: str = "off"
+    history_cache_ttl: int = 300
 
 
 def load_settings() -> Settings:
@@ -20,13 +41,41 @@ def load_settings() -> Settings:
     return Settings(
         base_url=os.getenv("API_BASE_URL", "https://healthcare-ai.goshoppie.com"),
         api_key=os.getenv("API_KEY", ""),
+        live_updates=os.getenv("LIVE_UPDATES", "off").lower(),
+        history_cache=os.getenv("HISTORY_CACHE", "off").lower(),
+        history_cache_ttl=int(os.getenv("HISTORY_CACHE_TTL", "300")),
     )
 
 
 class APIClient:
-    def __init__(self, settings: Settings):
+    def __init__(
+        self,
+        settings: Settings,
+        scheduler: Optional[CallScheduler] = None,
+        recorder: Optional[TraceRecorder] = None,
+        caller: Optional[str] = None,
+    ):
         self.settings = settings
+        # Scheduler fairness key, normally the Streamlit session id; calls
+        # fall back to the chat user_id when unset.
+        self.caller = caller
         self.session = requests.Session()
+        # Shared by all sessions in the process unless one is passed in.
+        self.scheduler = scheduler or get_scheduler()
+        # Opt-in via API_TRACE_FILE; see traffic.py.
+        self.recorder = recorder or get_recorder()
+        # The views build one client per rerun, so this groups a trace by rerun.
+        self.rerun_id = uuid.uuid4().hex[:12]
+        self.history_cache: Optional["HistoryCache"] = None
+        if settings.history_cache == "postgres":
+            # Imported here so psycopg2 is only needed when the cache is on.
+            from .history_cache import get_history_cache
+
+            self.history_cache = get_history_cache(settings.history_cache_ttl)
+
+    def _invalidate_history(self, user_id: int) -> None:
+        if self.history_cache is not None:
+            self.history_cache.invalidate(user_id)
 
     def _headers(self) -> Dict[str, str]:
         """Generate headers for API requests."""
@@ -38,26 +87,124 @@ class APIClient:
             headers["Authorization"] = f"Bearer {self.settings.api_key}"
         return headers
 
-    def get_history(self, user_id: int) -> List[Dict[str, Any]]:
-        """Get chat history for a user."""
-        url = f"{self.settings.base_url.rstrip('/')}/api/ai_chat/chats/{user_id}"
+    def _send(
+        self,
+        method: str,
+        path: str,
+        user_id: int,
+        priority: Optional[int],
+        timeout: Tuple[int, int],
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send one request, scheduled unless priority is None, and trace it."""
+        url = f"{self.settings.base_url.rstrip('/')}{path}"
+        slot = (
+            self.scheduler.slot(self.caller or user_id, priority)
+            if priority is not None
+            else nullcontext()
+        )
+        with slot:
+            started = time.time()
+            t0 = time.perf_counter()
+            r: Optional[requests.Response] = None
+            error: Optional[str] = None
+            try:
+                r = self.session.request(
+                    method, url, headers=self._headers(), timeout=timeout, **kwargs
+                )
+                return r
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                raise
+            finally:
+                if self.recorder is not None:
+                    self.recorder.record(
+                        rerun=self.rerun_id,
+                        method=method,
+                        path=path,
+                        params=kwargs.get("params"),
+                        payload=kwargs.get("json"),
+                        response=r,
+                        error=error,
+                        started=started,
+                        elapsed=time.perf_counter() - t0,
+                        background=priority != PRIORITY_INTERACTIVE,
+                    )
+
+    def get_history(
+        self,
+        user_id: int,
+        priority: int = PRIORITY_BACKGROUND,
+        fresh: bool = False,
+        strict: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Get chat history for a user, reading through the shared cache when
+        enabled. fresh=True skips a cached copy but still refreshes it.
+        Errors return [] unless strict=True, which re-raises them so
+        background callers can't mistake a failed fetch for an empty history.
+        """
+        version = 0
+        if self.history_cache is not None:
+            cached, version = self.history_cache.get(user_id)
+            if cached is not None and not fresh:
+                return cached
         try:
-            r = self.session.get(url, headers=self._headers(), timeout=(5, 20))
+            r = self._send(
+                "GET", f"/api/ai_chat/chats/{user_id}", user_id, priority, (5, 20)
+            )
             if r.status_code == 404:
-                return []
-            r.raise_for_status()
-            return r.json()
+                history = []
+            else:
+                r.raise_for_status()
+                history = r.json()
         except requests.exceptions.RequestException as e:
             print(f"Error getting chat history: {e}")
+            if strict:
+                raise
             return []
+        if self.history_cache is not None:
+            self.history_cache.put(user_id, history, version)
+        return history
+
+    def wait_for_updates(
+        self, user_id: int, after: Optional[str], wait: int = 25
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Long-poll for messages newer than the cursor `after`.
+        Returns {"cursor": ..., "messages": [...]} (messages empty when the
+        wait timed out) or None if the backend has no updates endpoint.
+        Not scheduled: the request mostly idles and would pin a slot.
+        """
+        params = {"wait": wait}
+        if after is not None:
+            params["after"] = after
+        r = self._send(
+            "GET",
+            f"/api/ai_chat/chats/{user_id}/updates",
+            user_id,
+            None,
+            (5, wait + 10),
+            params=params,
+        )
+        if r.status_code in (404, 405, 501):
+            return None
+        if r.status_code == 204:
+            return {"cursor": after, "messages": []}
+        r.raise_for_status()
+        return r.json()
 
     def post_chat(self, user_id: int, message: str) -> Dict[str, Any]:
         """Send a chat message."""
-        url = f"{self.settings.base_url.rstrip('/')}/api/v1/health-assistant/chat"
         payload = {"user_id": user_id, "user_message": message}
         try:
-            r = self.session.post(
-                url, json=payload, headers=self._headers(), timeout=(5, 60)
+            r = self._send(
+                "POST",
+                "/api/v1/health-assistant/chat",
+                user_id,
+                PRIORITY_INTERACTIVE,
+                (5, 60),
+                json=payload,
             )
             r.raise_for_status()
             return r.json()
@@ -68,24 +215,41 @@ class APIClient:
                 "role": "assistant",
                 "content": "Sorry, I encountered an error processing your request.",
             }
+        finally:
+            # Even a failed call may have written to the history.
+            self._invalidate_history(user_id)
 
     def submit_cardset(self, user_id: int, answers: Dict[str, str]) -> Dict[str, Any]:
         """Submit a completed cardset."""
-        url = f"{self.settings.base_url.rstrip('/')}/api/v1/health-assistant/cardset/submit"
         payload = {"user_id": user_id, "answers": answers}
         try:
-            r = self.session.post(
-                url, json=payload, headers=self._headers(), timeout=(5, 60)
+            r = self._send(
+                "POST",
+                "/api/v1/health-assistant/cardset/submit",
+                user_id,
+                PRIORITY_INTERACTIVE,
+                (5, 60),
+                json=payload,
             )
             r.raise_for_status()
             return r.json()
         except requests.exceptions.RequestException as e:
             print(f"Error submitting cardset: {e}")
             return {"status": "error", "message": f"Failed to submit cardset: {e}"}
+        finally:
+            self._invalidate_history(user_id)
 
     def delete_history(self, user_id: int):
-        url = f"{self.settings.base_url.rstrip('/')}/api/ai_chat/chats/{user_id}"
-        r = self.session.delete(url, headers=self._headers(), timeout=(5, 20))
+        try:
+            r = self._send(
+                "DELETE",
+                f"/api/ai_chat/chats/{user_id}",
+                user_id,
+                PRIORITY_INTERACTIVE,
+                (5, 20),
+            )
+        finally:
+            self._invalidate_history(user_id)
         # If backend returns 404 for "no history", treat as already cleared
         if r.status_code == 404:
             return {"status": "ok", "message": "No history to delete"}
@@ -1,8 +1,16 @@
 # chats_view.py
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 import streamlit as st
-from .api_client import APIClient, load_settings
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from . import live_updates, profiling
+from .api_client import APIClient, Settings, load_settings
+from .scheduler import PRIORITY_INTERACTIVE
+
+# Background history fetches used to reconcile optimistic chat turns.
+_RECONCILE_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chat-reconcile")
 
 
 def _try_parse_cardset(content: str) -> Optional[List[Dict[str, Any]]]:
@@ -13,11 +21,172 @@ def _try_parse_cardset(content: str) -> Optional[List[Dict[str, Any]]]:
         return None
 
 
+def _local_message(role: str, content: str, mtype: str = "chat") -> Dict[str, Any]:
+    """A message shown before the server has confirmed it."""
+    st.session_state.local_seq += 1
+    return {
+        "role": role,
+        "content": content,
+        "type": mtype,
+        "local_id": uuid.uuid4().hex,
+        "local_seq": st.session_state.local_seq,
+        "status": "pending",
+    }
+
+
+def _same_message(local: Dict[str, Any], server: Dict[str, Any]) -> bool:
+    if local.get("id") is not None and server.get("id") is not None:
+        return local["id"] == server["id"]
+    return local.get("role") == server.get("role") and local.get(
+        "content"
+    ) == server.get("content")
+
+
+def _reconcile(
+    local: List[Dict[str, Any]], server: List[Dict[str, Any]], seq: int
+) -> List[Dict[str, Any]]:
+    """
+    Merge a server history fetched after local message #seq was sent.
+    Server order wins; sent local messages up to seq are replaced by the
+    server copy, later or failed ones are kept in place, after the server
+    copy of whatever preceded them on screen.
+    """
+    after: Dict[int, List[Dict[str, Any]]] = {}
+    matched: set = set()
+    anchor = -1
+
+    def find(m: Dict[str, Any]) -> Optional[int]:
+        # Only look past the previous match: an older "ok" is not this "ok".
+        for i in range(anchor + 1, len(server)):
+            if i not in matched and _same_message(m, server[i]):
+                return i
+        return None
+
+    for m in local:
+        if m.get("status") == "pending":
+            # Not posted yet, so the server cannot have it.
+            after.setdefault(anchor, []).append(m)
+            continue
+        i = find(m)
+        if i is not None:
+            matched.add(i)
+            anchor = i
+            continue
+        if "local_id" in m and not (m["status"] == "sent" and m["local_seq"] <= seq):
+            after.setdefault(anchor, []).append(m)
+
+    merged = list(after.get(-1, []))
+    for i, s in enumerate(server):
+        merged.append(s)
+        merged.extend(after.get(i, []))
+    return merged
+
+
+def _start_reconcile(client: APIClient, user_id: int) -> None:
+    future = _RECONCILE_POOL.submit(client.get_history, user_id, strict=True)
+    st.session_state.reconcile = {"seq": st.session_state.local_seq, "future": future}
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        # Rerun once the fetch lands so it is merged without waiting for the
+        # user to click something.
+        session_id = ctx.session_id
+        future.add_done_callback(lambda _: live_updates.request_rerun(session_id))
+
+
+def _apply_reconcile() -> None:
+    pending = st.session_state.reconcile
+    if not pending or not pending["future"].done():
+        return
+    st.session_state.reconcile = None
+    try:
+        server = pending["future"].result()
+    except Exception:
+        # A failed background fetch is not the server's history; keep what
+        # is shown, the next send or push reconciles again.
+        return
+    st.session_state.server_messages = _reconcile(
+        st.session_state.server_messages, server, pending["seq"]
+    )
+
+
+def _queue_message(text: str) -> None:
+    """Add text to the transcript as pending; it is posted on the next rerun."""
+    st.session_state.server_messages.append(_local_message("user", text))
+
+
+def _deliver_pending(client: APIClient, user_id: int) -> bool:
+    """
+    Post pending messages (already on screen) and add the replies from the
+    post_chat responses. Returns True if anything was sent.
+    """
+    pending = [
+        m for m in st.session_state.server_messages if m.get("status") == "pending"
+    ]
+    for user_msg in pending:
+        user_msg["status"] = "failed"  # unless post_chat says otherwise
+        try:
+            resp = client.post_chat(user_id, user_msg["content"])
+        except Exception as e:
+            st.session_state.last_error = str(e)
+            continue
+        st.session_state.last_api_response = resp
+        if "error" in resp:
+            st.session_state.last_error = resp["error"]
+            continue
+
+        user_msg["status"] = "sent"
+        mtype = resp.get("type", "chat")
+        if mtype == "cardset":
+            st.session_state.pending_cardset = resp.get("questions", [])
+            reply = _local_message(
+                "assistant", json.dumps(resp.get("questions", [])), mtype
+            )
+        else:
+            reply = _local_message("assistant", resp.get("content", ""), mtype)
+        reply["status"] = "sent"
+        index = st.session_state.server_messages.index(user_msg)
+        st.session_state.server_messages.insert(index + 1, reply)
+    if pending:
+        _start_reconcile(client, user_id)
+    return bool(pending)
+
+
+def _follow_live_updates(settings: Settings, user_id: int) -> None:
+    """Merge messages pushed by the background listener for user_id."""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+
+    previous = st.session_state.live_user_id
+    if previous is not None and previous != user_id:
+        live_updates.unsubscribe(previous, ctx.session_id)
+        st.session_state.live_version = 0
+    st.session_state.live_user_id = user_id
+
+    listener = live_updates.subscribe(settings, user_id, ctx.session_id)
+    if listener is None or listener.version == st.session_state.live_version:
+        return
+    st.session_state.live_version = listener.version
+    # seq=0: pushed history may predate our last send, so local echoes are
+    # only dropped once the server copy actually shows up.
+    st.session_state.server_messages = _reconcile(
+        st.session_state.server_messages, listener.messages, 0
+    )
+
+
 def render_chat() -> None:
+    with profiling.profile_rerun("chat"):
+        _render_chat()
+    profiling.render_profile_panel()
+
+
+def _render_chat() -> None:
     st.header("Chat")
 
     settings = load_settings()
-    client = APIClient(settings)
+    ctx = get_script_run_ctx()
+    # Every admin shares the default user_id, so schedule per browser session.
+    client = APIClient(settings, caller=ctx.session_id if ctx else None)
 
     st.session_state.setdefault("user_id", 62)
     st.session_state.setdefault("server_messages", [])
@@ -27,11 +196,17 @@ def render_chat() -> None:
 
     # Add this after session_state defaults
     st.session_state.setdefault("history_loaded", False)
+    st.session_state.setdefault("local_seq", 0)
+    st.session_state.setdefault("reconcile", None)
+    st.session_state.setdefault("live_user_id", None)
+    st.session_state.setdefault("live_version", 0)
+
+    _apply_reconcile()
 
     if not st.session_state.history_loaded:
         try:
             st.session_state.server_messages = client.get_history(
-                int(st.session_state.user_id)
+                int(st.session_state.user_id), PRIORITY_INTERACTIVE
             )
             st.session_state.pending_cardset = None
         except Exception as e:
@@ -39,6 +214,8 @@ def render_chat() -> None:
         finally:
             st.session_state.history_loaded = True
 
+    _follow_live_updates(settings, int(st.session_state.user_id))
+
     st.subheader("Session")
 
     c_uid, c_actions = st.columns([1, 2], gap="small")
@@ -56,20 +233,25 @@ def render_chat() -> None:
 
     if load_clicked:
         st.session_state.server_messages = client.get_history(
-            int(st.session_state.user_id)
+            int(st.session_state.user_id), PRIORITY_INTERACTIVE
         )
+        st.session_state.reconcile = None
 
     if clear_clicked:
         st.session_state.server_messages = []
         st.session_state.pending_cardset = None
+        st.session_state.reconcile = None
         st.session_state.last_error = None
         st.session_state.last_api_response = {}
 
     if delete_clicked:
         resp = client.delete_history(int(st.session_state.user_id))
         st.session_state.last_api_response = resp
+        # The listener only appends pushed messages; make it start over.
+        live_updates.resync(int(st.session_state.user_id))
         st.session_state.server_messages = []  # clear UI immediately
         st.session_state.pending_cardset = None
+        st.session_state.reconcile = None
         st.success("Chat cleared on server.")
         st.rerun()
 
@@ -91,9 +273,10 @@ def render_chat() -> None:
             if st.button("Load history"):
                 try:
                     st.session_state.server_messages = client.get_history(
-                        int(st.session_state.user_id)
+                        int(st.session_state.user_id), PRIORITY_INTERACTIVE
                     )
                     st.session_state.pending_cardset = None
+                    st.session_state.reconcile = None
                     for m in reversed(st.session_state.server_messages):
                         if m.get("role") == "assistant" and m.get("type") == "cardset":
                             cs = _try_parse_cardset(m.get("content", ""))
@@ -107,12 +290,14 @@ def render_chat() -> None:
             if st.button("Clear UI"):
                 st.session_state.server_messages = []
                 st.session_state.pending_cardset = None
+                st.session_state.reconcile = None
                 st.session_state.last_error = None
                 st.session_state.last_api_response = None
 
     if st.session_state.last_error:
         st.error(st.session_state.last_error)
 
+    retry_msg = None
     for msg in st.session_state.server_messages:
         role = msg.get("role", "assistant")
         mtype = msg.get("type", "chat")
@@ -124,6 +309,22 @@ def render_chat() -> None:
                 )
             else:
                 st.write(content)
+            if msg.get("status") == "pending":
+                st.caption("Sending…")
+            elif msg.get("status") == "failed":
+                st.caption("Not sent.")
+                if st.button("Retry", key=f"retry_{msg['local_id']}"):
+                    retry_msg = msg
+
+    if retry_msg is not None:
+        retry_msg["status"] = "pending"
+        st.session_state.last_error = None
+        st.rerun()
+
+    # The transcript above already shows pending messages, so the user sees
+    # their own message while post_chat runs.
+    if _deliver_pending(client, int(st.session_state.user_id)):
+        st.rerun()
 
     if st.session_state.pending_cardset:
         st.divider()
@@ -149,21 +350,26 @@ def render_chat() -> None:
                 resp = client.submit_cardset(int(st.session_state.user_id), answers)
                 st.session_state.last_api_response = resp
                 st.session_state.server_messages = client.get_history(
-                    int(st.session_state.user_id)
+                    int(st.session_state.user_id), PRIORITY_INTERACTIVE
                 )
                 st.session_state.pending_cardset = None
+                st.session_state.reconcile = None
                 st.rerun()
 
     prompt = st.chat_input("Type a message…")
     if prompt:
-        resp = client.post_chat(int(st.session_state.user_id), prompt)
-        st.session_state.last_api_response = resp
-        if resp.get("type") == "cardset":
-            st.session_state.pending_cardset = resp.get("questions", [])
-        st.session_state.server_messages = client.get_history(
-            int(st.session_state.user_id)
-        )
+        # Rerun to draw the message first; it is posted after the transcript
+        # renders, the reply comes from the post_chat response and the
+        # history refetch runs in the background.
+        _queue_message(prompt)
         st.rerun()
 
     with st.expander("Debug: last API response"):
         st.json(st.session_state.last_api_response)
+
+    with st.expander("Debug: backend scheduler"):
+        st.json(client.scheduler.stats())
+
+    if client.history_cache is not None:
+        with st.expander("Debug: history cache"):
+            st.json(client.history_cache.stats())
@@ -1,15 +1,17 @@
 import os
 from dotenv import load_dotenv
 import psycopg2
-from typing import Optional, Any
+from typing import Optional, Any, Dict
 from psycopg2.extras import DictCursor
 
+from .prompt_versions import VERSIONS_DDL
+
 # Load environment variables from .env file
 load_dotenv()
 
-def get_conn():
+def conn_params() -> Dict[str, Any]:
     """
-    Create and return a database connection.
+    Connection settings shared by get_conn() and connection pools.
     
     Environment variables used:
     - DB_HOST: Database host (default: localhost)
@@ -18,13 +20,17 @@ def get_conn():
     - DB_USER: Database user (default: postgres)
     - DB_PASSWORD: Database password (default: postgres)
     """
-    conn = psycopg2.connect(
+    return dict(
         host=os.getenv('DB_HOST', 'localhost'),
         port=os.getenv('DB_PORT', '5432'),
         dbname=os.getenv('DB_NAME', 'health_assistant'),
         user=os.getenv('DB_USER', 'postgres'),
         password=os.getenv('DB_PASSWORD', 'postgres')
     )
+
+def get_conn():
+    """Create and return a database connection (see conn_params())."""
+    conn = psycopg2.connect(**conn_params())
     conn.autocommit = True
     return conn
 
@@ -62,6 +68,9 @@ def init_db():
                 BEFORE UPDATE ON ai_prompts
                 FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
             """)
+
+            # Append-only prompt history (see prompt_versions.py)
+            cur.execute(VERSIONS_DDL)
             
         conn.commit()
         print("Database initialized successfully")
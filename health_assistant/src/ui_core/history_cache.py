@@ -0,0 +1,261 @@
+# history_cache.py
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from .db import conn_params
+
+# UNLOGGED: no WAL, so writes are cheap; the table is emptied after a crash,
+# which is fine for a cache.
+CACHE_DDL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS ai_history_cache (
+        user_id BIGINT PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        payload JSONB,
+        expires_at TIMESTAMP WITH TIME ZONE
+    )
+"""
+
+# Expired rows are kept this long before the sweeper deletes them, so their
+# version still rejects late writes from requests that started earlier.
+SWEEP_GRACE = 300
+
+# The cache must never be slower than the backend it fronts: bounded
+# connects and statements, and after a connection failure skip Postgres for
+# a while. Invalidations are never skipped; ones that fail are retried in the
+# background every RETRY_INTERVAL seconds until they succeed.
+POOL_SIZE = int(os.getenv("HISTORY_CACHE_POOL_SIZE", "4"))
+CONNECT_TIMEOUT = int(os.getenv("HISTORY_CACHE_CONNECT_TIMEOUT", "2"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("HISTORY_CACHE_STATEMENT_TIMEOUT_MS", "500"))
+RETRY_AFTER = 30
+RETRY_INTERVAL = 1
+
+
+class HistoryCache:
+    """
+    Chat history cache shared by every replica through Postgres.
+
+    Each row carries a version that invalidate() bumps. put() only stores
+    a payload if the version is unchanged since the get() that missed, so a
+    slow read can't overwrite a newer invalidation with stale history.
+    Database errors, timeouts and an exhausted pool are counted and treated
+    as misses. Connections are opened on first use and kept for reuse, up to
+    POOL_SIZE; no lock is held while talking to Postgres.
+    """
+
+    def __init__(self, ttl: int = 300, sweep_interval: int = 60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._idle: List[Any] = []
+        self._open = 0
+        self._ready = False
+        self._down_until = 0.0
+        # user_id -> invalidate() calls so far, for invalidations that failed;
+        # retried by the background thread.
+        self._pending: Dict[int, int] = {}
+        self._lock = threading.Lock()  # counters, idle list, pending set
+        self._counts = {
+            "hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "stale_puts": 0,
+            "invalidations": 0,
+            "swept": 0,
+            "errors": 0,
+            "skipped": 0,
+        }
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._worker = threading.Thread(
+            target=self._background_loop, name="history-cache-worker", daemon=True
+        )
+        self._worker.start()
+
+    def _acquire(self) -> Optional[Any]:
+        """An idle connection, a new one, or None when POOL_SIZE are in use."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._open >= POOL_SIZE:
+                return None
+            self._open += 1
+        try:
+            return psycopg2.connect(
+                connect_timeout=CONNECT_TIMEOUT,
+                options=f"-c statement_timeout={STATEMENT_TIMEOUT_MS}",
+                **conn_params(),
+            )
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def _release(self, conn: Any) -> None:
+        with self._lock:
+            if conn.closed:
+                self._open -= 1
+            else:
+                self._idle.append(conn)
+
+    def _execute(
+        self, sql: str, params: Tuple[Any, ...] = (), force: bool = False
+    ) -> Optional[Any]:
+        """
+        Run one statement; returns the cursor's row/rowcount or None on error.
+        Skipped while backing off from a connection failure unless force.
+        """
+        if not force and time.monotonic() < self._down_until:
+            self._count("skipped")
+            return None
+        conn = None
+        try:
+            conn = self._acquire()
+            if conn is None:
+                # Don't wait for a busy pool; a miss is cheaper.
+                self._count("errors")
+                return None
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                if not self._ready:
+                    cur.execute(CACHE_DDL)
+                    self._ready = True
+                cur.execute(sql, params)
+                return cur.fetchone() if cur.description else cur.rowcount
+        except psycopg2.Error as e:
+            print(f"History cache error: {e}")
+            self._count("errors")
+            # Only back off when Postgres can't be reached. A statement
+            # timeout leaves the connection usable; a dropped one is closed
+            # and discarded, and the next call reconnects.
+            if conn is None:
+                self._down_until = time.monotonic() + RETRY_AFTER
+            return None
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += n
+
+    def get(self, user_id: int) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """(history, version) on a hit, (None, version) on a miss."""
+        with self._lock:
+            stale = user_id in self._pending
+        if stale:
+            # Our own invalidation hasn't reached Postgres yet.
+            self._count("misses")
+            return None, 0
+        row = self._execute(
+            "SELECT version, payload, expires_at > NOW() FROM ai_history_cache "
+            "WHERE user_id = %s",
+            (user_id,),
+        )
+        if not row:
+            self._count("misses")
+            return None, 0
+        version, payload, fresh = row
+        if payload is None or not fresh:
+            self._count("misses")
+            return None, version
+        self._count("hits")
+        return payload, version
+
+    def put(self, user_id: int, history: List[Dict[str, Any]], version: int) -> None:
+        rowcount = self._execute(
+            """
+            INSERT INTO ai_history_cache (user_id, version, payload, expires_at)
+            VALUES (%s, %s, %s, NOW() + %s * INTERVAL '1 second')
+            ON CONFLICT (user_id) DO UPDATE
+            SET payload = EXCLUDED.payload, expires_at = EXCLUDED.expires_at
+            WHERE ai_history_cache.version = EXCLUDED.version
+            """,
+            (user_id, version, json.dumps(history), self.ttl),
+        )
+        if rowcount is not None:
+            self._count("puts" if rowcount else "stale_puts")
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Mark user_id's history stale for every replica. While Postgres is
+        unreachable the invalidation is queued for the background thread
+        instead of blocking the caller; it is retried until it succeeds.
+        """
+        if time.monotonic() < self._down_until or not self._invalidate(user_id):
+            with self._lock:
+                self._pending[user_id] = self._pending.get(user_id, 0) + 1
+            self._wake.set()
+
+    def _invalidate(self, user_id: int) -> bool:
+        result = self._execute(
+            """
+            INSERT INTO ai_history_cache (user_id, version, payload, expires_at)
+            VALUES (%s, 1, NULL, NOW())
+            ON CONFLICT (user_id) DO UPDATE
+            SET version = ai_history_cache.version + 1,
+                payload = NULL,
+                expires_at = NOW()
+            """,
+            (user_id,),
+            force=True,
+        )
+        if result is None:
+            return False
+        self._count("invalidations")
+        return True
+
+    def _retry_invalidations(self) -> None:
+        with self._lock:
+            pending = list(self._pending.items())
+        for user_id, calls in pending:
+            if not self._invalidate(user_id):
+                return
+            with self._lock:
+                # A newer invalidate() may have raced this one; keep it.
+                if self._pending.get(user_id) == calls:
+                    del self._pending[user_id]
+
+    def sweep(self) -> None:
+        rowcount = self._execute(
+            "DELETE FROM ai_history_cache "
+            "WHERE expires_at < NOW() - %s * INTERVAL '1 second'",
+            (SWEEP_GRACE,),
+        )
+        if rowcount:
+            self._count("swept", rowcount)
+
+    def _background_loop(self) -> None:
+        next_sweep = time.monotonic() + self.sweep_interval
+        while not self._stop.is_set():
+            self._wake.wait(RETRY_INTERVAL)
+            self._wake.clear()
+            self._retry_invalidations()
+            if time.monotonic() >= next_sweep:
+                self.sweep()
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._counts)
+            out["pending_invalidations"] = len(self._pending)
+            out["connections"] = self._open
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 3) if lookups else None
+        return out
+
+
+_cache: Optional[HistoryCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_history_cache(ttl: int = 300) -> HistoryCache:
+    """The cache shared by every session in this process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HistoryCache(ttl=ttl)
+        return _cache
@@ -0,0 +1,307 @@
+# live_updates.py
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+
+from .api_client import APIClient, Settings
+
+# How long a listener keeps running after its last session went away.
+IDLE_TIMEOUT = 60
+# Poll interval when the backend has no long-poll endpoint.
+POLL_INTERVAL = 10
+LONG_POLL_WAIT = 25
+
+
+def _fingerprint(messages: List[Dict[str, Any]]) -> str:
+    return json.dumps(messages, sort_keys=True, default=str)
+
+
+class APIHistoryFeed:
+    """Long-polls the backend; falls back to polling get_history."""
+
+    def __init__(self, client: APIClient, user_id: int):
+        self.client = client
+        self.user_id = user_id
+        self.long_poll = True
+        self._cursor: Optional[str] = None
+        self._messages: List[Dict[str, Any]] = []
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Full history; also restarts the long-poll cursor from it."""
+        # strict: a failed fetch must raise, not look like an empty history.
+        self._messages = self.client.get_history(
+            self.user_id, fresh=True, strict=True
+        )
+        self._cursor = None
+        if self._messages and self._messages[-1].get("id") is not None:
+            self._cursor = str(self._messages[-1]["id"])
+        return list(self._messages)
+
+    def wait(self, stop: threading.Event) -> Optional[List[Dict[str, Any]]]:
+        """Block until the history changes; return it, or None if unchanged."""
+        if self.long_poll:
+            started = time.monotonic()
+            resp = self.client.wait_for_updates(
+                self.user_id, self._cursor, LONG_POLL_WAIT
+            )
+            if resp is None:
+                self.long_poll = False
+            else:
+                self._cursor = resp.get("cursor", self._cursor)
+                new = resp.get("messages") or []
+                if not new:
+                    # Don't spin if the backend answers without waiting.
+                    stop.wait(max(0.0, 1 - (time.monotonic() - started)))
+                    return None
+                self._messages = self._messages + new
+                return list(self._messages)
+
+        if stop.wait(POLL_INTERVAL):
+            return None
+        # fresh: changes made outside this app never invalidate the cache.
+        messages = self.client.get_history(self.user_id, fresh=True, strict=True)
+        if _fingerprint(messages) == _fingerprint(self._messages):
+            return None
+        self._messages = messages
+        return list(messages)
+
+
+class LocalHistoryBus:
+    """In-process stand-in for the backend's update stream, for testing."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._messages: Dict[int, List[Dict[str, Any]]] = {}
+
+    def publish(self, user_id: int, message: Dict[str, Any]) -> None:
+        with self._cond:
+            self._messages.setdefault(user_id, []).append(message)
+            self._cond.notify_all()
+
+    def clear(self, user_id: int) -> None:
+        with self._cond:
+            self._messages.pop(user_id, None)
+            self._cond.notify_all()
+
+    def feed(self, user_id: int) -> "LocalHistoryFeed":
+        return LocalHistoryFeed(self, user_id)
+
+
+class LocalHistoryFeed:
+    def __init__(self, bus: LocalHistoryBus, user_id: int):
+        self.bus = bus
+        self.user_id = user_id
+        self._seen: List[Dict[str, Any]] = []
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self.bus._cond:
+            self._seen = list(self.bus._messages.get(self.user_id, []))
+        return list(self._seen)
+
+    def wait(self, stop: threading.Event) -> Optional[List[Dict[str, Any]]]:
+        with self.bus._cond:
+            changed = self.bus._cond.wait_for(
+                lambda: stop.is_set()
+                or self.bus._messages.get(self.user_id, []) != self._seen,
+                timeout=LONG_POLL_WAIT,
+            )
+            if not changed or stop.is_set():
+                return None
+            self._seen = list(self.bus._messages.get(self.user_id, []))
+            return list(self._seen)
+
+
+local_bus = LocalHistoryBus()
+
+
+def _session_info(session_id: str) -> Tuple[bool, Any]:
+    """(runtime reachable, active session info or None)."""
+    try:
+        from streamlit.runtime import get_instance
+
+        return True, get_instance()._session_mgr.get_active_session_info(session_id)
+    except Exception:
+        return False, None
+
+
+def _session_gone(session_id: str) -> bool:
+    reachable, info = _session_info(session_id)
+    return reachable and info is None
+
+
+def request_rerun(session_id: str) -> bool:
+    """Ask Streamlit to rerun one browser session from a background thread."""
+    _, info = _session_info(session_id)
+    if info is None:
+        return False
+    # Rerun with the session's current client state, as Streamlit does for
+    # source changes; None would drop the query string and page.
+    session = info.session
+    session.request_rerun(getattr(session, "_client_state", None))
+    return True
+
+
+class HistoryListener:
+    """
+    Background thread that follows one user's history and reruns the
+    sessions watching it, but only when the history actually changed.
+    """
+
+    def __init__(self, user_id: int, feed: Any):
+        self.user_id = user_id
+        self.feed = feed
+        self.version = 0
+        self.messages: List[Dict[str, Any]] = []
+        self.last_error: Optional[str] = None
+        self._sessions: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._resync = threading.Event()
+        self._idle_since: Optional[float] = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"history-listener-{user_id}", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive() and not self._stop.is_set()
+
+    def add_session(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.add(session_id)
+            self._idle_since = None
+
+    def remove_session(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.discard(session_id)
+
+    def resync(self) -> None:
+        """
+        Refetch the full history, e.g. after it was deleted; incremental
+        updates still in flight are dropped.
+        """
+        self._resync.set()
+
+    def _notify(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions)
+        for session_id in sessions:
+            if not request_rerun(session_id):
+                self.remove_session(session_id)
+
+    def _idle(self) -> bool:
+        # Closed tabs never unsubscribe; drop sessions Streamlit no longer has.
+        with self._lock:
+            sessions = list(self._sessions)
+        for session_id in sessions:
+            if _session_gone(session_id):
+                self.remove_session(session_id)
+        with self._lock:
+            if self._sessions:
+                return False
+            if self._idle_since is None:
+                self._idle_since = time.monotonic()
+            return time.monotonic() - self._idle_since > IDLE_TIMEOUT
+
+    def _publish(self, messages: List[Dict[str, Any]]) -> None:
+        self.messages = messages
+        self.version += 1
+        self._notify()
+
+    def _run(self) -> None:
+        backoff = 1
+        try:
+            self.messages = self.feed.snapshot()
+        except Exception as e:
+            # Without a snapshot the first update would be published as the
+            # whole history; keep retrying the snapshot instead.
+            self.last_error = str(e)
+            self._resync.set()
+            self._stop.wait(backoff)
+            backoff *= 2
+
+        while not self._stop.is_set():
+            if self._idle():
+                break
+            try:
+                if self._resync.is_set():
+                    self._resync.clear()
+                    try:
+                        messages = self.feed.snapshot()
+                    except Exception:
+                        self._resync.set()
+                        raise
+                    if _fingerprint(messages) != _fingerprint(self.messages):
+                        self._publish(messages)
+                    backoff = 1
+                    continue
+                messages = self.feed.wait(self._stop)
+                backoff = 1
+            except requests.exceptions.RequestException as e:
+                self.last_error = str(e)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            # An update that raced a resync is relative to the old history.
+            if messages is None or self._resync.is_set():
+                continue
+            self._publish(messages)
+
+        self._stop.set()
+        _forget(self)
+
+
+_listeners: Dict[int, HistoryListener] = {}
+_listeners_lock = threading.Lock()
+
+
+def _forget(listener: HistoryListener) -> None:
+    with _listeners_lock:
+        if _listeners.get(listener.user_id) is listener:
+            del _listeners[listener.user_id]
+
+
+def _make_feed(settings: Settings, user_id: int) -> Any:
+    if settings.live_updates == "local":
+        return local_bus.feed(user_id)
+    return APIHistoryFeed(APIClient(settings, caller=f"listener:{user_id}"), user_id)
+
+
+def subscribe(
+    settings: Settings, user_id: int, session_id: str
+) -> Optional[HistoryListener]:
+    """Attach a session to the (shared) listener for user_id."""
+    if settings.live_updates not in ("api", "local"):
+        return None
+    with _listeners_lock:
+        listener = _listeners.get(user_id)
+        if listener is None or not listener.alive:
+            listener = HistoryListener(user_id, _make_feed(settings, user_id))
+            _listeners[user_id] = listener
+            listener.start()
+        listener.add_session(session_id)
+    return listener
+
+
+def resync(user_id: int) -> None:
+    """Make the listener for user_id refetch its full history."""
+    with _listeners_lock:
+        listener = _listeners.get(user_id)
+    if listener is not None:
+        listener.resync()
+
+
+def unsubscribe(user_id: int, session_id: str) -> None:
+    with _listeners_lock:
+        listener = _listeners.get(user_id)
+    if listener is not None:
+        listener.remove_session(session_id)
@@ -0,0 +1,189 @@
+# profiling.py
+"""
+Per-rerun profiling, off unless asked for:
+
+  ?profile=1 (or =sample)   sampling profiler, collapsed stacks
+  ?profile=cprofile         adds cProfile (.prof) for exact call counts
+  UI_PROFILE=1|cprofile     same, for every session
+
+Collapsed-stack files load directly into flamegraph.pl or speedscope. Only
+the newest UI_PROFILE_KEEP files (default 200) are kept in UI_PROFILE_DIR.
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import streamlit as st
+
+PROFILE_DIR = os.getenv("UI_PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = float(os.getenv("UI_PROFILE_INTERVAL", "0.005"))
+KEEP_FILES = int(os.getenv("UI_PROFILE_KEEP", "200"))
+TOP_N = 20
+
+
+def profiling_mode() -> Optional[str]:
+    """None when disabled, otherwise "sample" or "cprofile"."""
+    mode = st.query_params.get("profile") or os.getenv("UI_PROFILE", "")
+    mode = str(mode).lower()
+    if mode in ("", "0", "off", "false"):
+        return None
+    return "cprofile" if mode == "cprofile" else "sample"
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _prune(directory: str, keep: int) -> None:
+    """Delete the oldest profile files beyond keep."""
+    try:
+        paths = [
+            os.path.join(directory, f)
+            for f in os.listdir(directory)
+            if f.endswith((".collapsed", ".prof"))
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # another session pruned it first
+
+
+class _Sampler:
+    """Samples one thread's stack on a timer into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="rerun-sampler", daemon=True
+        )
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        total = sum(self.stacks.values()) or 1
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        return [
+            {
+                "function": label,
+                "self_%": round(count / total * 100, 1),
+                "total_%": round(inclusive[label] / total * 100, 1),
+                "samples": count,
+            }
+            for label, count in own.most_common(n)
+        ]
+
+
+def _cprofile_top(profiler: cProfile.Profile, n: int) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:n]
+    return [
+        {
+            "function": f"{func} ({os.path.basename(file)}:{line})",
+            "self_ms": round(tt * 1000, 2),
+            "total_ms": round(ct * 1000, 2),
+            "calls": nc,
+        }
+        for (file, line, func), (cc, nc, tt, ct, _) in rows
+    ]
+
+
+@contextmanager
+def profile_rerun(name: str) -> Iterator[None]:
+    """Profile the wrapped block when profiling_mode() is on; else a no-op."""
+    mode = profiling_mode()
+    if mode is None:
+        yield
+        return
+
+    sampler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL)
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    started = time.perf_counter()
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        # Also runs when the block ends in st.rerun()/st.stop().
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        elapsed = time.perf_counter() - started
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}"
+        stem = os.path.join(PROFILE_DIR, f"{name}-{stamp}")
+        with open(f"{stem}.collapsed", "w", encoding="utf-8") as f:
+            for stack, count in sampler.stacks.items():
+                f.write(f"{stack} {count}\n")
+        files = [f"{stem}.collapsed"]
+        if profiler is not None:
+            profiler.dump_stats(f"{stem}.prof")
+            files.append(f"{stem}.prof")
+        _prune(PROFILE_DIR, max(KEEP_FILES, len(files)))
+
+        st.session_state.last_profile = {
+            "name": name,
+            "mode": mode,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "samples": sum(sampler.stacks.values()),
+            "files": files,
+            "top": (
+                _cprofile_top(profiler, TOP_N)
+                if profiler is not None
+                else sampler.top(TOP_N)
+            ),
+        }
+
+
+def render_profile_panel() -> None:
+    """Debug expander with the last profiled rerun; hidden when disabled."""
+    if profiling_mode() is None:
+        return
+    with st.expander("Debug: profile"):
+        prof = st.session_state.get("last_profile")
+        if not prof:
+            st.caption("No profiled rerun yet.")
+            return
+        st.caption(
+            f"{prof['name']} · {prof['mode']} · {prof['elapsed_ms']} ms · "
+            f"{prof['samples']} samples"
+        )
+        st.dataframe(prof["top"], use_container_width=True, hide_index=True)
+        for path in prof["files"]:
+            st.code(path, language=None)
@@ -0,0 +1,177 @@
+import difflib
+import json
+from typing import Any, Dict, List, Optional
+
+# Every SNAPSHOT_EVERY-th version is stored in full so that rebuilding any
+# version replays at most SNAPSHOT_EVERY - 1 deltas.
+SNAPSHOT_EVERY = 10
+
+VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS ai_prompt_versions (
+        name VARCHAR(255) NOT NULL,
+        version INTEGER NOT NULL,
+        is_snapshot BOOLEAN NOT NULL,
+        body TEXT NOT NULL,
+        note TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (name, version)
+    )
+"""
+
+
+def ensure_versions_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(VERSIONS_DDL)
+    conn.commit()
+
+
+def _split(text: str) -> List[str]:
+    return text.splitlines(keepends=True)
+
+
+def _make_delta(old: str, new: str) -> List[Any]:
+    """
+    Line-level delta from old to new:
+      [i1, i2]   copy old lines i1:i2
+      "text"     insert literal text
+    """
+    a, b = _split(old), _split(new)
+    ops: List[Any] = []
+    sm = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def _apply_delta(old: str, ops: List[Any]) -> str:
+    a = _split(old)
+    out: List[str] = []
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        else:
+            out.extend(a[op[0] : op[1]])
+    return "".join(out)
+
+
+def latest_version(conn, name: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM ai_prompt_versions WHERE name = %s",
+            (name,),
+        )
+        return int(cur.fetchone()[0])
+
+
+def list_versions(conn, name: str) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT version, is_snapshot, note, created_at FROM ai_prompt_versions "
+            "WHERE name = %s ORDER BY version DESC",
+            (name,),
+        )
+        rows = cur.fetchall()
+        return [
+            {
+                "version": r[0],
+                "is_snapshot": r[1],
+                "note": r[2],
+                "created_at": str(r[3]),
+            }
+            for r in rows
+        ]
+
+
+def get_version(conn, name: str, version: int) -> Optional[str]:
+    """Rebuild a version from the nearest snapshot at or below it."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT version, is_snapshot, body FROM ai_prompt_versions
+            WHERE name = %s AND version <= %s AND version >= (
+                SELECT MAX(version) FROM ai_prompt_versions
+                WHERE name = %s AND version <= %s AND is_snapshot
+            )
+            ORDER BY version
+            """,
+            (name, version, name, version),
+        )
+        rows = cur.fetchall()
+    if not rows or rows[-1][0] != version:
+        return None
+
+    text = rows[0][2]
+    for _, is_snapshot, body in rows[1:]:
+        text = body if is_snapshot else _apply_delta(text, json.loads(body))
+    return text
+
+
+def append_version(conn, name: str, prompt: str, note: Optional[str] = None) -> int:
+    """
+    Append prompt as the next version of name and return its number.
+    Must run inside a transaction (not autocommit): the ai_prompts row is
+    locked FOR UPDATE so concurrent saves of the same prompt are numbered
+    one after the other. Does not commit; callers commit together with the
+    ai_prompts update. Saving unchanged text is a no-op that returns the
+    current version; a name with no ai_prompts row is not versioned (0).
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT prompt FROM ai_prompts WHERE name = %s FOR UPDATE", (name,)
+        )
+        row = cur.fetchone()
+    if row is None:
+        return 0
+
+    current = latest_version(conn, name)
+
+    if current == 0:
+        # First save since versioning was enabled: keep what is in
+        # ai_prompts now as version 1 so it can be rolled back to.
+        if row[0] is not None and row[0] != prompt:
+            _insert(conn, name, 1, True, row[0], "baseline")
+            current = 1
+
+    if current == 0:
+        _insert(conn, name, 1, True, prompt, note)
+        return 1
+
+    previous = get_version(conn, name, current)
+    if previous == prompt:
+        return current
+
+    version = current + 1
+    if previous is None or (version - 1) % SNAPSHOT_EVERY == 0:
+        _insert(conn, name, version, True, prompt, note)
+    else:
+        delta = json.dumps(_make_delta(previous, prompt), ensure_ascii=False)
+        # Fall back to a full copy when the delta would not save space.
+        if len(delta) < len(prompt):
+            _insert(conn, name, version, False, delta, note)
+        else:
+            _insert(conn, name, version, True, prompt, note)
+    return version
+
+
+def _insert(
+    conn, name: str, version: int, is_snapshot: bool, body: str, note: Optional[str]
+) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO ai_prompt_versions (name, version, is_snapshot, body, note) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (name, version, is_snapshot, body, note),
+        )
+
+
+def diff_versions(conn, name: str, a: int, b: int) -> str:
+    old = get_version(conn, name, a) or ""
+    new = get_version(conn, name, b) or ""
+    return "".join(
+        difflib.unified_diff(
+            _split(old), _split(new), fromfile=f"v{a}", tofile=f"v{b}"
+        )
+    )
@@ -2,6 +2,8 @@ from typing import Any, Dict, List, Optional
 import json
 from psycopg2.extras import DictCursor
 
+from .prompt_versions import append_version, get_version
+
 
 def list_prompts(conn) -> List[Dict[str, Any]]:
     with conn.cursor() as cur:
@@ -30,10 +32,45 @@ def get_prompt(conn, name: str) -> Optional[Dict[str, Any]]:
         }
 
 
-def update_prompt(conn, name: str, prompt: str, meta: Dict[str, Any]) -> None:
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE ai_prompts SET prompt = %s, meta = %s WHERE name = %s",
-            (prompt, json.dumps(meta), name),  # keep it parameterized. [web:377]
-        )
+def update_prompt(
+    conn,
+    name: str,
+    prompt: str,
+    meta: Optional[Dict[str, Any]] = None,
+    note: Optional[str] = None,
+) -> int:
+    """Save prompt and record it in ai_prompt_versions; returns the version."""
+    # db.get_conn() connections are autocommit, which would release the row
+    # lock append_version takes before the version is inserted.
+    autocommit = conn.autocommit
+    if autocommit:
+        conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            version = append_version(conn, name, prompt, note)
+            if meta is None:
+                cur.execute(
+                    "UPDATE ai_prompts SET prompt = %s WHERE name = %s",
+                    (prompt, name),
+                )
+            else:
+                cur.execute(
+                    "UPDATE ai_prompts SET prompt = %s, meta = %s WHERE name = %s",
+                    (prompt, json.dumps(meta), name),  # keep it parameterized. [web:377]
+                )
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if autocommit:
+            conn.autocommit = True
+    return version
+
+
+def rollback_prompt(conn, name: str, version: int) -> Optional[int]:
+    """Restore an earlier version by saving it again as a new version."""
+    prompt = get_version(conn, name, version)
+    if prompt is None:
+        return None
+    return update_prompt(conn, name, prompt, note=f"rollback to v{version}")
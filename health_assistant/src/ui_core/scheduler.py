@@ -0,0 +1,173 @@
+# scheduler.py
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import requests
+
+# Lower runs first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class AdmissionTimeout(requests.exceptions.Timeout):
+    """A call waited too long for a slot and was not sent."""
+
+
+class CallScheduler:
+    """
+    Process-wide admission control for backend calls.
+
+    Calls queue by (priority, arrival). A queued call is admitted when a
+    global slot is free, its caller is below the per-caller limit and the
+    token bucket has a token; a caller at their limit is skipped so the next
+    one in line goes first instead of everyone waiting behind them. A caller
+    is whoever should get a fair share, normally one browser session.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        per_caller_concurrency: int = 2,
+        rate: float = 20.0,
+        burst: int = 20,
+        max_wait: float = 30.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_caller_concurrency = per_caller_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._queue: List[List[Any]] = []  # [priority, seq, caller, admitted]
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_by_caller: Dict[Any, int] = {}
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+
+        self._waits: Dict[int, Deque[float]] = {
+            PRIORITY_INTERACTIVE: deque(maxlen=500),
+            PRIORITY_BACKGROUND: deque(maxlen=500),
+        }
+        self._admitted = 0
+        self._timeouts = 0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            float(self.burst), self._tokens + (now - self._refilled) * self.rate
+        )
+        self._refilled = now
+
+    def _admit(self, now: float) -> Optional[float]:
+        """
+        Admit as many queued calls as limits allow. Returns how long to wait
+        for the next token when that is the only thing holding calls back.
+        """
+        self._refill(now)
+        for entry in sorted(self._queue):
+            if self._active >= self.max_concurrency:
+                return None
+            caller = entry[2]
+            if self._active_by_caller.get(caller, 0) >= self.per_caller_concurrency:
+                continue
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+            self._tokens -= 1
+            self._active += 1
+            self._active_by_caller[caller] = self._active_by_caller.get(caller, 0) + 1
+            entry[3] = True
+            self._queue.remove(entry)
+            self._cond.notify_all()
+        return None
+
+    def _release(self, caller: Any) -> None:
+        with self._cond:
+            self._active -= 1
+            left = self._active_by_caller.get(caller, 1) - 1
+            if left:
+                self._active_by_caller[caller] = left
+            else:
+                self._active_by_caller.pop(caller, None)
+            self._admit(time.monotonic())
+
+    @contextmanager
+    def slot(
+        self, caller: Any, priority: int = PRIORITY_INTERACTIVE
+    ) -> Iterator[None]:
+        """Block until the call may run; raises AdmissionTimeout after max_wait."""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        entry = [priority, next(self._seq), caller, False]
+
+        with self._cond:
+            self._queue.append(entry)
+            while True:
+                token_wait = self._admit(time.monotonic())
+                if entry[3]:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    self._timeouts += 1
+                    raise AdmissionTimeout(
+                        f"Backend busy: waited {self.max_wait:.0f}s for a slot"
+                    )
+                self._cond.wait(min(remaining, token_wait or remaining))
+            self._admitted += 1
+            self._waits.setdefault(priority, deque(maxlen=500)).append(
+                time.monotonic() - start
+            )
+
+        try:
+            yield
+        finally:
+            self._release(caller)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, concurrency and recent queue-wait percentiles (ms)."""
+        with self._cond:
+            out: Dict[str, Any] = {
+                "queued": len(self._queue),
+                "active": self._active,
+                "admitted": self._admitted,
+                "timeouts": self._timeouts,
+                "tokens": round(self._tokens, 2),
+            }
+            for priority, waits in self._waits.items():
+                name = "interactive" if priority == PRIORITY_INTERACTIVE else "background"
+                ordered = sorted(waits)
+                if not ordered:
+                    continue
+                out[f"{name}_wait_ms"] = {
+                    "p50": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95": round(ordered[int(len(ordered) * 0.95)] * 1000, 1),
+                    "max": round(ordered[-1] * 1000, 1),
+                }
+            return out
+
+
+_scheduler: Optional[CallScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> CallScheduler:
+    """The scheduler shared by every session in this process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CallScheduler(
+                max_concurrency=int(os.getenv("API_MAX_CONCURRENCY", "8")),
+                per_caller_concurrency=int(
+                    os.getenv("API_PER_SESSION_CONCURRENCY", "2")
+                ),
+                rate=float(os.getenv("API_RATE_LIMIT", "20")),
+                burst=int(os.getenv("API_RATE_BURST", "20")),
+                max_wait=float(os.getenv("API_MAX_QUEUE_WAIT", "30")),
+            )
+        return _scheduler
@@ -0,0 +1,442 @@
+# traffic.py
+"""
+Record-and-replay of backend traffic for performance regression checks.
+
+Record: set API_TRACE_FILE=traces/run.ndjson and use the app as usual; every
+APIClient call is appended as one redacted JSON line.
+
+Replay:
+    python -m src.ui_core.traffic traces/run.ndjson --speed 10 --out after.json
+    python -m src.ui_core.traffic traces/run.ndjson --baseline before.json
+
+Replay serves the recorded responses from a local stand-in backend and
+re-drives the same APIClient calls, rerun by rerun, reporting client-side
+latency and CPU per rerun.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Values under these keys are structural and kept as-is; every other scalar
+# is masked: strings keep their length so payload sizes stay realistic,
+# numbers become 0 and booleans False.
+_KEEP_KEYS = {"id", "version", "role", "type", "status", "cursor", "after", "wait"}
+_ID_KEYS = {"user_id"}
+_USER_PATH = re.compile(r"(/chats/)(\d+)")
+
+
+def _pseudonym(user_id: Any) -> int:
+    salt = os.getenv("API_TRACE_SALT", "")
+    digest = hashlib.sha256(f"{salt}:{user_id}".encode()).hexdigest()
+    return int(digest[:8], 16) % 1_000_000
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Strip PHI from a request/response body, keeping its shape and size."""
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, key) for v in value]
+    if key in _ID_KEYS and value is not None:
+        return _pseudonym(value)
+    if value is None or key in _KEEP_KEYS:
+        return value
+    if isinstance(value, str):
+        return "x" * len(value)
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return type(value)(0)
+    return value
+
+
+def redact_path(path: str) -> str:
+    return _USER_PATH.sub(lambda m: f"{m.group(1)}{_pseudonym(m.group(2))}", path)
+
+
+class TraceRecorder:
+    """Appends one NDJSON line per backend call. Thread-safe."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(
+        self,
+        rerun: str,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]],
+        payload: Any,
+        response: Any,
+        error: Optional[str],
+        started: float,
+        elapsed: float,
+        background: bool = False,
+    ) -> None:
+        body: Any = None
+        status = None
+        if response is not None:
+            status = response.status_code
+            try:
+                body = response.json() if response.content else None
+            except ValueError:
+                body = response.text
+        line = {
+            "ts": started,
+            # Background calls (reconciles, listener polls) outlive the rerun
+            # whose client made them, so they are not grouped under it.
+            "rerun": None if background else rerun,
+            "background": background,
+            "method": method,
+            "path": redact_path(path),
+            "params": redact(params),
+            "request": redact(payload),
+            "status": status,
+            "response": redact(body),
+            "error": redact_path(error) if error else None,
+            "elapsed_ms": round(elapsed * 1000, 2),
+        }
+        data = json.dumps(line, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data + "\n")
+
+
+_recorder: Optional[TraceRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder() -> Optional[TraceRecorder]:
+    """The process-wide recorder, or None unless API_TRACE_FILE is set."""
+    global _recorder
+    path = os.getenv("API_TRACE_FILE")
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None or _recorder.path != path:
+            _recorder = TraceRecorder(path)
+        return _recorder
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["ts"])
+
+
+class ReplayBackend:
+    """
+    Local stand-in backend answering from a trace. Responses for the same
+    (method, path) are served in recorded order; the last one repeats once
+    they run out. Foreground and background calls get separate backends so
+    neither consumes the other's responses.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], latency_scale: float = 0.0):
+        self.latency_scale = latency_scale
+        self._responses: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(
+            deque
+        )
+        self._last: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        for r in records:
+            if r.get("status") is not None:
+                self._responses[(r["method"], r["path"])].append(r)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="replay-backend", daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _next(self, method: str, path: str) -> Optional[Dict[str, Any]]:
+        key = (method, path)
+        with self._lock:
+            queue = self._responses.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            return self._last.get(key)
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                rec = backend._next(self.command, self.path.split("?", 1)[0])
+                if rec is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if backend.latency_scale:
+                    time.sleep(rec["elapsed_ms"] / 1000 * backend.latency_scale)
+                body = b""
+                if rec.get("response") is not None:
+                    body = json.dumps(rec["response"]).encode()
+                self.send_response(rec["status"])
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_DELETE = _reply
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "ReplayBackend":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _user_id(path: str) -> int:
+    m = _USER_PATH.search(path)
+    return int(m.group(2)) if m else 0
+
+
+def _drive(client: Any, rec: Dict[str, Any]) -> None:
+    """Repeat one recorded call through the matching APIClient method."""
+    method, path = rec["method"], rec["path"]
+    body = rec.get("request") or {}
+    if method == "POST" and path.endswith("/cardset/submit"):
+        client.submit_cardset(body.get("user_id", 0), body.get("answers", {}))
+    elif method == "POST" and path.endswith("/chat"):
+        client.post_chat(body.get("user_id", 0), body.get("user_message", ""))
+    elif method == "DELETE":
+        try:
+            client.delete_history(_user_id(path))
+        except Exception:
+            pass
+    elif path.endswith("/updates"):
+        params = rec.get("params") or {}
+        try:
+            client.wait_for_updates(_user_id(path), params.get("after"), 0)
+        except Exception:
+            pass
+    else:
+        client.get_history(_user_id(path))
+
+
+def _pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 2)
+
+
+def _replay_background(
+    client: Any,
+    calls: List[Dict[str, Any]],
+    origin: float,
+    first_ts: float,
+    scale: float,
+    latencies: Dict[str, List[float]],
+) -> None:
+    for rec in calls:
+        if scale:
+            due = origin + (rec["ts"] - first_ts) * scale
+            time.sleep(max(0.0, due - time.perf_counter()))
+        t0 = time.perf_counter()
+        _drive(client, rec)
+        latencies[f"{rec['method']} {_endpoint(rec['path'])}"].append(
+            (time.perf_counter() - t0) * 1000
+        )
+
+
+def replay(
+    records: List[Dict[str, Any]], speed: float = 1.0, server_latency: bool = True
+) -> Dict[str, Any]:
+    """
+    Re-drive the recorded reruns against a ReplayBackend. speed scales the
+    gaps between reruns (and server latency); speed <= 0 runs back to back.
+    Background calls replay on their own thread and are reported separately;
+    long-polls are skipped since their latency is idle waiting.
+    """
+    from .api_client import APIClient, Settings
+    from .scheduler import CallScheduler
+
+    reruns: Dict[str, List[Dict[str, Any]]] = {}
+    background: List[Dict[str, Any]] = []
+    for rec in records:
+        if rec.get("background"):
+            if not rec["path"].endswith("/updates"):
+                background.append(rec)
+        else:
+            reruns.setdefault(rec["rerun"], []).append(rec)
+
+    scale = (1 / speed) if speed > 0 else 0.0
+    rows = []
+    by_endpoint: Dict[str, List[float]] = defaultdict(list)
+    bg_by_endpoint: Dict[str, List[float]] = defaultdict(list)
+
+    latency = scale if server_latency else 0.0
+    fg_records = [r for r in records if not r.get("background")]
+    bg_records = [r for r in records if r.get("background")]
+    with ReplayBackend(fg_records, latency) as backend, ReplayBackend(
+        bg_records, latency
+    ) as bg_backend:
+        scheduler = CallScheduler()
+        client = APIClient(
+            Settings(base_url=backend.base_url),
+            scheduler=scheduler,
+            recorder=_NO_RECORDER,
+        )
+        bg_client = APIClient(
+            Settings(base_url=bg_backend.base_url),
+            scheduler=scheduler,
+            recorder=_NO_RECORDER,
+        )
+
+        origin = time.perf_counter()
+        first_ts = records[0]["ts"] if records else 0.0
+        bg_thread = threading.Thread(
+            target=_replay_background,
+            args=(bg_client, background, origin, first_ts, scale, bg_by_endpoint),
+            name="replay-background",
+            daemon=True,
+        )
+        bg_thread.start()
+        for rerun, calls in reruns.items():
+            if scale:
+                due = origin + (calls[0]["ts"] - first_ts) * scale
+                time.sleep(max(0.0, due - time.perf_counter()))
+            wall0, cpu0 = time.perf_counter(), time.thread_time()
+            for rec in calls:
+                t0 = time.perf_counter()
+                _drive(client, rec)
+                by_endpoint[f"{rec['method']} {_endpoint(rec['path'])}"].append(
+                    (time.perf_counter() - t0) * 1000
+                )
+            rows.append(
+                {
+                    "rerun": rerun,
+                    "calls": len(calls),
+                    "wall_ms": round((time.perf_counter() - wall0) * 1000, 2),
+                    "cpu_ms": round((time.thread_time() - cpu0) * 1000, 2),
+                }
+            )
+        bg_thread.join()
+
+    walls = [r["wall_ms"] for r in rows]
+    cpus = [r["cpu_ms"] for r in rows]
+    return {
+        "reruns": len(rows),
+        "calls": sum(r["calls"] for r in rows),
+        "wall_ms": {"p50": _pct(walls, 0.5), "p95": _pct(walls, 0.95)},
+        "cpu_ms": {
+            "p50": _pct(cpus, 0.5),
+            "p95": _pct(cpus, 0.95),
+            "total": round(sum(cpus), 2),
+        },
+        "endpoints": {
+            k: {"n": len(v), "p50": _pct(v, 0.5), "p95": _pct(v, 0.95)}
+            for k, v in sorted(by_endpoint.items())
+        },
+        "background": {
+            k: {"n": len(v), "p50": _pct(v, 0.5), "p95": _pct(v, 0.95)}
+            for k, v in sorted(bg_by_endpoint.items())
+        },
+        "per_rerun": rows,
+        "scheduler": scheduler.stats(),
+    }
+
+
+class _NoRecorder:
+    def record(self, **kwargs: Any) -> None:
+        pass
+
+
+# Replayed calls must not be appended to the trace being replayed.
+_NO_RECORDER: Any = _NoRecorder()
+
+
+def _endpoint(path: str) -> str:
+    return _USER_PATH.sub(r"\1{user_id}", path)
+
+
+def _compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    lines = []
+    for metric in ("wall_ms", "cpu_ms"):
+        for q in ("p50", "p95"):
+            before = baseline.get(metric, {}).get(q)
+            after = current[metric][q]
+            if before:
+                change = (after - before) / before * 100
+                lines.append(
+                    f"{metric} {q}: {before} -> {after} ({change:+.1f}%)"
+                )
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("trace", help="NDJSON trace recorded with API_TRACE_FILE")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="timing multiplier (1 = original, 10 = 10x faster, 0 = no gaps)",
+    )
+    parser.add_argument(
+        "--no-server-latency",
+        action="store_true",
+        help="answer immediately instead of replaying recorded latency",
+    )
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--baseline", help="report JSON to compare against")
+    args = parser.parse_args(argv)
+
+    records = load_trace(args.trace)
+    if not records:
+        print("Trace is empty.", file=sys.stderr)
+        return 1
+
+    report = replay(records, args.speed, not args.no_server_latency)
+
+    print(f"reruns: {report['reruns']}  calls: {report['calls']}")
+    print(f"wall ms  p50={report['wall_ms']['p50']}  p95={report['wall_ms']['p95']}")
+    print(
+        f"cpu ms   p50={report['cpu_ms']['p50']}  p95={report['cpu_ms']['p95']}"
+        f"  total={report['cpu_ms']['total']}"
+    )
+    for name, s in report["endpoints"].items():
+        print(f"  {name:<55} n={s['n']:<5} p50={s['p50']}  p95={s['p95']}")
+    if report["background"]:
+        print("background:")
+        for name, s in report["background"].items():
+            print(f"  {name:<55} n={s['n']:<5} p50={s['p50']}  p95={s['p95']}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            for line in _compare(report, json.load(f)):
+                print(line)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())